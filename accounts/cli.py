@@ -2,14 +2,13 @@ import sys
 import argparse
 import csv
 from collections import deque
-import re
+from contextlib import ExitStack
+from functools import lru_cache
 from datetime import datetime, timedelta
 
-import dateutil.parser
-
 from accounts import model
 from accounts.hierarchy import StringHierarchy
-from accounts.pydo import pydo_input
+from accounts.pydo import pydo_input, pydo_session
 
 HISTORY_SIZE = 100
 
@@ -38,9 +37,32 @@ def get_args():
                         default=model.DEFAULT_LEDGER_MAXIMUM_AGE,
                         help="Maximum age, in days, of entries in ledger file "
                         "to use for training.")
+    parser.add_argument("-a", "--assume-predictions", action="store_true",
+                        help="Accept every prediction without prompting. "
+                        "Needs training data.")
     return parser.parse_args()
 
 
+def parse_day_first_date(date_string):
+    """Parses dates like 31/01/2018, returns None for anything else
+
+    Only handles the cases where dateutil would read the fields in the same
+    order, so that it can be used as a shortcut for it.
+
+    """
+    for separator in "/-.":
+        fields = date_string.split(separator)
+        if len(fields) == 3:
+            day, month, year = fields
+            if (len(day) <= 2 and len(month) <= 2 and len(year) == 4
+                    and all(field.isdecimal() for field in fields)
+                    and int(month) <= 12):
+                return datetime(int(year), int(month), int(day))
+            return None
+    return None
+
+
+@lru_cache(maxsize=256)
 def clean_date(date_string):
     """Makes a proper date string
 
@@ -48,7 +70,11 @@ def clean_date(date_string):
     format.
 
     """
-    date = dateutil.parser.parse(date_string, dayfirst=True)
+    date = parse_day_first_date(date_string.strip())
+    if date is None:
+        # dateutil is slow to import and rarely needed
+        import dateutil.parser
+        date = dateutil.parser.parse(date_string, dayfirst=True)
     return date.strftime("%Y-%m-%d")
 
 
@@ -59,19 +85,17 @@ def format_amount(amount, currency, negative=True):
 
     """
     amount = amount.strip()
-    amount, n_subs = re.subn(r"^-", "", amount)
-    was_neg = bool(n_subs % 2)
-    if was_neg:
+    if amount.startswith("-"):
+        amount = amount[1:]
         sign = ""
     else:
         sign = "-"
     return f"{sign}{currency}{amount}"
 
 
-def format_transaction(date, payee, account_in, account_out, amount, currency):
-    """Formats a simple two account transaction into Ledger format."""
-    date = clean_date(date)
-    amount = format_amount(amount, currency)
+def format_transaction(date, payee, account_in, account_out, amount):
+    """Formats a simple two account transaction into Ledger format. The date
+and amount must already be cleaned with clean_date and format_amount."""
     s = f"{date} {payee}\n    {account_in:<36}{amount:>12}\n    {account_out}\n"
     return s
 
@@ -81,7 +105,8 @@ def run(csv_file,
          ledger_output,
          training_data=None,
          currency=DEFAULT_CURRENCY,
-         ledger_maximum_age=model.DEFAULT_LEDGER_MAXIMUM_AGE):
+         ledger_maximum_age=model.DEFAULT_LEDGER_MAXIMUM_AGE,
+         assume_predictions=False):
 
     clf = None
     all_accounts = set()
@@ -94,41 +119,67 @@ def run(csv_file,
         if len(X) > 0:
             clf = model.make_model()
             clf.fit(X, y)
+    if assume_predictions and clf is None:
+        sys.exit("Nothing to predict with, training data is needed "
+                 "to assume predictions.")
 
-    history = deque([], HISTORY_SIZE)
-    hierarchy = StringHierarchy(all_accounts, separator=":")
+    # check and clean every row up front so that a bad row is found before
+    # the user has gone through all the ones before it
+    dates, payees, amounts, ledger_dates = [], [], [], []
     for i, record in enumerate(csv.reader(csv_file)):
         try:
             date, payee, amount = record
         except ValueError as e:
             sys.exit(f"Error on line {i}: {e}")
+        try:
+            ledger_dates.append(clean_date(date))
+        except (ValueError, OverflowError) as e:
+            sys.exit(f"Invalid date on line {i}: {e}")
+        dates.append(date)
+        payees.append(payee)
+        amounts.append(amount)
+    ledger_amounts = [format_amount(amount, currency) for amount in amounts]
+
+    if clf and payees:
+        # predict all at once, sklearn has a large overhead per call, and
+        # only once per payee since the same ones turn up again and again
+        cleaned = model.clean_strings(payees)
+        unique = list(set(cleaned))
+        prediction_ids = dict(zip(unique, clf.predict(unique)))
+        predictions = [target_names[prediction_ids[payee]]
+                       for payee in cleaned]
+    else:
+        predictions = [""] * len(payees)
 
-        if clf:
-            cleaned = model.clean_string(payee)
-            prediction_id = clf.predict([cleaned])[0]
-            prediction = target_names[prediction_id]
-        else:
-            prediction = ""
-
-        typed = pydo_input(hierarchy,
-                           prompt=f"[{date}] {payee} ({amount}): ",
-                           initial_string=prediction,
-                           forbidden=[" "],
-                           history=history)
-        if typed:
-            if len(history) == 0 or typed != history[0]:
-                history.appendleft(typed)
-                all_accounts.add(typed)
-                hierarchy = StringHierarchy(all_accounts, separator=":")
-
-            try:
-                entry = format_transaction(date, payee, typed, account_name,
-                                           amount, currency)
-            except (ValueError, OverflowError) as e:
-                sys.exit(f"Ivalid date on line {i}: {e}")
-            print(entry, file=ledger_output)
-        else:
-            break
+    history = deque([], HISTORY_SIZE)
+    hierarchy = StringHierarchy(all_accounts, separator=":")
+    with ExitStack() as stack:
+        if not assume_predictions:
+            # keep the terminal set up for all of the prompts
+            session = stack.enter_context(pydo_session())
+        for i, prediction in enumerate(predictions):
+            if assume_predictions:
+                typed = prediction
+            else:
+                typed = pydo_input(hierarchy,
+                                   prompt=f"[{dates[i]}] {payees[i]} "
+                                   f"({amounts[i]}): ",
+                                   initial_string=prediction,
+                                   forbidden=[" "],
+                                   history=history,
+                                   session=session)
+            if typed:
+                if len(history) == 0 or typed != history[0]:
+                    history.appendleft(typed)
+                if typed not in all_accounts:
+                    all_accounts.add(typed)
+                    hierarchy.add(typed)
+
+                entry = format_transaction(ledger_dates[i], payees[i], typed,
+                                           account_name, ledger_amounts[i])
+                ledger_output.write(f"{entry}\n")
+            else:
+                break
 
     print("Bye.")
 
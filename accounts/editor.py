@@ -1,11 +1,23 @@
-import itertools
+import re
+from os.path import commonprefix
 from collections import deque, namedtuple
+from functools import lru_cache
 from curtsies import fsarray, fmtstr
 from curtsies.fmtfuncs import yellow
 
 
 Completion = namedtuple("Completion", ["node", "type"])
 
+# word boundaries are any non-alphabetic characters
+NON_ALPHA_RE = re.compile(r"[\W\d_]")
+LAST_NON_ALPHA_RE = re.compile(r".*[\W\d_]", re.DOTALL)
+
+
+@lru_cache(maxsize=256)
+def prompt_fmtstr(prompt):
+    """Returns prompt coloured, cached as it stays the same while editing."""
+    return yellow(prompt)
+
 
 def complete(completions):
     """Returns the common prefix of given strings."""
@@ -13,10 +25,70 @@ def complete(completions):
         return completions[0].node.label
     strings = [completion.node.label for completion in completions
                if completion.type > 1]
-    chars_it = itertools.takewhile(lambda chars: len(set(chars)) <= 1,
-                                   zip(*strings))
-    string = "".join(chars[0] for chars in chars_it)
-    return string
+    return commonprefix(strings)
+
+
+class GapBuffer():
+    """Characters split into two lists at the cursor
+
+    The characters before the cursor are kept in order in left and the ones
+    after it in reverse order in right, so editing at the cursor only touches
+    the ends of the lists.
+
+    """
+    def __init__(self, string=""):
+        self.left = list(string)
+        self.right = []
+        self._string = None     # joined string, until next edit
+
+    def __len__(self):
+        return len(self.left) + len(self.right)
+
+    def __str__(self):
+        if self._string is None:
+            self._string = "".join(self.left) + "".join(reversed(self.right))
+        return self._string
+
+    @property
+    def cursor(self):
+        return len(self.left)
+
+    @cursor.setter
+    def cursor(self, position):
+        position = max(0, min(position, len(self)))
+        left, right = self.left, self.right
+        if position < len(left):
+            right.extend(reversed(left[position:]))
+            del left[position:]
+        elif position > len(left):
+            split = len(right) - (position - len(left))
+            left.extend(reversed(right[split:]))
+            del right[split:]
+
+    def insert(self, chars):
+        """Inserts chars before the cursor."""
+        self.left.extend(chars)
+        self._string = None
+
+    def delete_backward(self, count=1):
+        """Deletes count characters before the cursor and returns them."""
+        split = len(self.left) - count
+        deleted = self.left[split:]
+        del self.left[split:]
+        self._string = None
+        return deleted
+
+    def delete_forward(self):
+        """Deletes everything after the cursor and returns it."""
+        deleted = self.right[::-1]
+        self.right.clear()
+        self._string = None
+        return deleted
+
+    def clear(self):
+        self.left.clear()
+        self.right.clear()
+        self._string = None
 
 
 class Editor():
@@ -25,126 +97,147 @@ class Editor():
                  initial_string="",
                  history=[],
                  killring_size=5):
-        self.typed = deque(initial_string)
-        self.cursor = len(self.typed)
-        self.forbidden = forbidden
+        self.typed = GapBuffer(initial_string)
+        self.forbidden = frozenset(forbidden)
         self.killring = deque([], killring_size)
         self.history = history
         self.history_pos = -1
         self.new_history = None
+        self.rendered = None    # last (width, prompt, string, tail, fsarray)
+
+    @property
+    def cursor(self):
+        return self.typed.cursor
+
+    @cursor.setter
+    def cursor(self, position):
+        self.typed.cursor = position
 
     def empty(self):
         """Set the string to empty."""
-        self.typed = deque()
-        self.cursor = 0
+        self.typed = GapBuffer()
 
     def set_string(self, string):
         """Set the string to the given string."""
-        self.typed = deque(string)
-        self.cursor = len(self.typed)
+        self.typed = GapBuffer(string)
 
     def edit_string(self, key, completions):
         """Edit string and move cursor according to given key."""
-        if self.cursor > len(self.typed):
-            self.cursor = len(self.typed)
         if len(key) == 1:
             if key not in self.forbidden:
-                self.typed.insert(self.cursor, key)
-                self.cursor += 1
-        elif key == "<SPACE>":
-            if " " not in self.forbidden:
-                self.typed.insert(self.cursor, " ")
-                self.cursor += 1
-        elif key == "<TAB>":
-            if self.cursor == len(self.typed):
-                completed = complete(completions)
-                if completed:
-                    self.typed = deque(completed)
-                    self.cursor = len(self.typed)
-        elif key == "<Ctrl-a>":
-            self.cursor = 0
-        elif key in ["<Ctrl-b>", "<LEFT>"]:
-            self.cursor = max(0, self.cursor-1)
-        elif key == "<Ctrl-e>":
-            self.cursor = len(self.typed)
-        elif key in ["<Ctrl-f>", "<RIGHT>"]:
-            self.cursor = min(len(self.typed), self.cursor+1)
-        elif key in ["<Ctrl-h>", "<BACKSPACE>"]:
-            if self.cursor > 0:
-                del self.typed[self.cursor-1]
-                self.cursor -= 1
-        elif key == "<Ctrl-k>":
-            lst = list(self.typed)
-            self.typed = deque(lst[:self.cursor])
-            self.killring.append(lst[self.cursor:])
-        elif key == "<Ctrl-l>":
-            self.typed.clear()
-            self.cursor = 0
-        elif key in ["<Ctrl-n>", "<DOWN>"]:
-            if self.history_pos > 0:
-                self.history_pos -= 1
-                self.typed = deque(self.history[self.history_pos])
-                self.cursor = len(self.typed)
-            elif self.history_pos == 0:
-                self.history_pos -= 1
-                self.typed = self.new_history
-                self.cursor = len(self.typed)
-        elif key in ["<Ctrl-p>", "<UP>"]:
-            if len(self.history) > self.history_pos + 1:
-                if self.history_pos == -1:
-                    self.new_history = self.typed
-                self.history_pos += 1
-                self.typed = deque(self.history[self.history_pos])
-                self.cursor = len(self.typed)
-        elif key == "<Ctrl-y>":
-            lst = list(self.typed)
-            yanked = self.killring[-1]
-            self.typed = deque(lst[:self.cursor] + yanked + lst[self.cursor:])
-            self.cursor += len(yanked)
-        elif key == "<Esc+b>":
-            self.cursor = self.backward_word()
-        elif key == "<Esc+f>":
-            self.cursor = self.forward_word()
-        elif key in ["<Ctrl-BACKSPACE>", "<Esc+BACKSPACE>"]:
-            p = self.backward_word()
-            lst = list(self.typed)
-            self.typed = deque(lst[:p] + lst[self.cursor:])
-            self.killring.append(lst[p:self.cursor])
-            self.cursor = p
+                self.typed.insert(key)
+        else:
+            handler = self._KEY_HANDLERS.get(key)
+            if handler:
+                handler(self, completions)
+
+    def _insert_space(self, completions):
+        if " " not in self.forbidden:
+            self.typed.insert(" ")
+
+    def _complete(self, completions):
+        if self.cursor == len(self.typed):
+            completed = complete(completions)
+            if completed:
+                self.typed = GapBuffer(completed)
+
+    def _beginning_of_line(self, completions):
+        self.cursor = 0
+
+    def _backward_char(self, completions):
+        self.cursor = max(0, self.cursor-1)
+
+    def _end_of_line(self, completions):
+        self.cursor = len(self.typed)
+
+    def _forward_char(self, completions):
+        self.cursor = min(len(self.typed), self.cursor+1)
+
+    def _delete_backward_char(self, completions):
+        if self.cursor > 0:
+            self.typed.delete_backward()
+
+    def _kill_line(self, completions):
+        self.killring.append(self.typed.delete_forward())
+
+    def _clear(self, completions):
+        self.typed.clear()
+
+    def _next_history(self, completions):
+        if self.history_pos > 0:
+            self.history_pos -= 1
+            self.typed = GapBuffer(self.history[self.history_pos])
+        elif self.history_pos == 0:
+            self.history_pos -= 1
+            self.typed = GapBuffer(self.new_history)
+
+    def _previous_history(self, completions):
+        if len(self.history) > self.history_pos + 1:
+            if self.history_pos == -1:
+                self.new_history = self.to_string()
+            self.history_pos += 1
+            self.typed = GapBuffer(self.history[self.history_pos])
+
+    def _yank(self, completions):
+        if self.killring:
+            self.typed.insert(self.killring[-1])
+
+    def _backward_word(self, completions):
+        self.cursor = self.backward_word()
+
+    def _forward_word(self, completions):
+        self.cursor = self.forward_word()
+
+    def _backward_kill_word(self, completions):
+        p = self.backward_word()
+        self.killring.append(self.typed.delete_backward(self.cursor - p))
+
+    _KEY_HANDLERS = {
+        "<SPACE>": _insert_space,
+        "<TAB>": _complete,
+        "<Ctrl-a>": _beginning_of_line,
+        "<Ctrl-b>": _backward_char,
+        "<LEFT>": _backward_char,
+        "<Ctrl-e>": _end_of_line,
+        "<Ctrl-f>": _forward_char,
+        "<RIGHT>": _forward_char,
+        "<Ctrl-h>": _delete_backward_char,
+        "<BACKSPACE>": _delete_backward_char,
+        "<Ctrl-k>": _kill_line,
+        "<Ctrl-l>": _clear,
+        "<Ctrl-n>": _next_history,
+        "<DOWN>": _next_history,
+        "<Ctrl-p>": _previous_history,
+        "<UP>": _previous_history,
+        "<Ctrl-y>": _yank,
+        "<Esc+b>": _backward_word,
+        "<Esc+f>": _forward_word,
+        "<Ctrl-BACKSPACE>": _backward_kill_word,
+        "<Esc+BACKSPACE>": _backward_kill_word,
+    }
 
     def find_forwards(self, char):
         """Finds next character in forward direction, or end."""
-        try:
-            p = list(self.typed).index(char, self.cursor+1)
-            return p
-        except ValueError:
-            return len(self.typed)
+        string = str(self.typed)
+        p = string.find(char, self.cursor+1)
+        return p if p >= 0 else len(string)
 
     def find_backwards(self, char):
         """Finds next character in backward direction, or start."""
-        try:
-            # position of cursor in reverse list
-            c = len(self.typed) - self.cursor
-            p = list(reversed(self.typed)).index(char, c+1)
-            return len(self.typed) - p
-        except ValueError:
-            return 0
+        p = str(self.typed).rfind(char, 0, max(0, self.cursor-1))
+        return p+1 if p >= 0 else 0
 
     def forward_word(self):
         """Finds next position forwards of a non-alphabetic character."""
-        for i in range(self.cursor+1, len(self.typed)):
-            if not self.typed[i].isalpha():
-                return i
-        else:
-            return len(self.typed)
+        string = str(self.typed)
+        match = NON_ALPHA_RE.search(string, self.cursor+1)
+        return match.start() if match else len(string)
 
     def backward_word(self):
         """Finds next position backwards of a non-alphabetic character."""
-        for i in range(self.cursor-2, -1, -1):
-            if not self.typed[i].isalpha():
-                return i+1
-        else:
-            return 0
+        match = LAST_NON_ALPHA_RE.match(str(self.typed), 0,
+                                        max(0, self.cursor-1))
+        return match.end() if match else 0
 
     def has_more_history(self):
         """Returns True if there is further history, otherwise False."""
@@ -156,13 +249,13 @@ class Editor():
     def to_fsarray(self, width, prompt, tail=""):
         """Returns wrapped and coloured output as an fsarray. Includes the given
 prompt and tail and fits in the given width."""
-        string = yellow(prompt) + fmtstr("".join(self.typed)) + tail
+        string = prompt_fmtstr(prompt) + fmtstr(str(self.typed)) + tail
         chunks = [string[i:i+width] for i in range(0, len(string), width)]
         return fsarray(chunks)
 
     def to_string(self):
         """Returns the contents as a string."""
-        return "".join(self.typed)
+        return str(self.typed)
 
     def cursor_pos(self, width, prompt):
         """Gives the cursor position on the final line of the wrapped output."""
@@ -170,7 +263,16 @@ prompt and tail and fits in the given width."""
         return (cursor//width, cursor % width)
 
     def render_to(self, win, prompt="", tail=""):
-        """Renders the output to the given curtsies CursorAwareWindow."""
-        fsa = self.to_fsarray(win.width, prompt, tail)
+        """Renders the output to the given curtsies CursorAwareWindow. The
+previous output is reused if only the cursor has moved, the tail is compared
+by identity as its formatting can change without its text changing."""
+        string = self.to_string()
+        last = self.rendered
+        if (last and last[0] == win.width and last[1] == prompt
+                and last[2] == string and last[3] is tail):
+            fsa = last[4]
+        else:
+            fsa = self.to_fsarray(win.width, prompt, tail)
+            self.rendered = (win.width, prompt, string, tail, fsa)
         cur = self.cursor_pos(win.width, prompt)
         win.render_to_terminal(fsa, cur)
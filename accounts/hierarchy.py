@@ -1,9 +1,27 @@
 from abc import ABCMeta, abstractmethod
+from stat import S_ISDIR
 from pathlib import Path
-from collections import namedtuple, deque
+from collections import namedtuple
 
 
-Node = namedtuple("Node", ["label", "internal"])
+class Node(namedtuple("Node", ["label", "internal", "label_lower"])):
+    """Node of a hierarchy, with its label lowercased once for matching."""
+    __slots__ = ()
+
+    def __new__(cls, label, internal):
+        return super().__new__(cls, label, internal, label.lower())
+
+    def __getnewargs__(self):
+        # for copy and pickle, which call __new__ with these
+        return (self.label, self.internal)
+
+    def _replace(self, **fields):
+        """Returns a new Node with fields replaced, label_lower follows label."""
+        label = fields.pop("label", self.label)
+        internal = fields.pop("internal", self.internal)
+        if fields:
+            raise ValueError(f"Got unexpected field names: {list(fields)!r}")
+        return type(self)(label, internal)
 
 
 class Hierarchy(metaclass=ABCMeta):
@@ -13,7 +31,7 @@ class Hierarchy(metaclass=ABCMeta):
 
     @abstractmethod
     def get_subtree(self, path=[]):
-        """Returns subtree at given path."""
+        """Returns subtree at given path, as Nodes sorted by label."""
         pass
 
     @abstractmethod
@@ -25,18 +43,24 @@ class Hierarchy(metaclass=ABCMeta):
 class StringHierarchy(Hierarchy):
     def __init__(self, strings, separator=""):
         self.tree = {}
-        self._strings = set(strings)
+        self._strings = set()
         self._separator = separator
-        if not separator:
-            self.tree = {s: None for s in strings}
+        self._subtrees = {}     # nodes by path, until the tree changes
+        for string in strings:
+            self.add(string)
+
+    def add(self, string):
+        """Adds string to the tree, creating any missing segments."""
+        self._strings.add(string)
+        self._subtrees.clear()
+        if not self._separator:
+            self.tree[string] = None
         else:
-            for string in self._strings:
-                segments = string.split(separator)
-                current_dict = self.tree
-                for segment in segments:
-                    if segment not in current_dict:
-                        current_dict[segment] = {}
-                    current_dict = current_dict[segment]
+            current_dict = self.tree
+            for segment in string.split(self._separator):
+                if segment not in current_dict:
+                    current_dict[segment] = {}
+                current_dict = current_dict[segment]
 
     @property
     def separator(self):
@@ -45,31 +69,28 @@ class StringHierarchy(Hierarchy):
     def _dict_to_nodes(self, dictionary):
         return [Node(label=k, internal=True) if dictionary[k]
                 else Node(label=k, internal=False)
-                for k in dictionary]
+                for k in sorted(dictionary)]
 
     def get_subtree(self, path=[]):
-        current_dict = self.tree
-        for item in path:
-            current_dict = current_dict[item]
-        return self._dict_to_nodes(current_dict)
+        key = tuple(path)
+        nodes = self._subtrees.get(key)
+        if nodes is None:
+            current_dict = self.tree
+            for item in path:
+                current_dict = current_dict[item]
+            nodes = self._subtrees[key] = self._dict_to_nodes(current_dict)
+        return nodes
 
     def get_partial_path(self, path=[]):
         current_dict = self.tree
-        found_path = []
-        rest_path = deque(path)
-        try:
-            for item in path:
-                new_dict = current_dict[item]
-                if new_dict:
-                    current_dict = new_dict
-                    rest_path.popleft()
-                    found_path.append(item)
-                else:
-                    break
-        except KeyError:
-            pass
-        finally:
-            return found_path, list(rest_path)
+        i = 0
+        for item in path:
+            new_dict = current_dict.get(item)
+            if not new_dict:
+                break
+            current_dict = new_dict
+            i += 1
+        return list(path[:i]), list(path[i:])
 
     def __str__(self):
         return f"<StringHierarchy: {len(self._strings)} strings>"
@@ -79,31 +100,37 @@ class DirectoryHierarchy(Hierarchy):
     def __init__(self, location="."):
         self.root = Path(location)
         self._separator = "/"
+        self._subtrees = {}     # (mtime, nodes) by path
 
     def _loc_to_nodes(self, location):
         return [Node(label=p.name, internal=True) if p.is_dir()
                 else Node(label=p.name, internal=False)
-                for p in location.iterdir()]
+                for p in sorted(location.iterdir(), key=lambda p: p.name)]
 
     def get_subtree(self, path=[]):
         current_location = self.root
         for item in path:
             current_location = current_location / item
-        if current_location.is_dir():
-            return self._loc_to_nodes(current_location)
-        else:
+        try:
+            stat = current_location.stat()
+        except OSError:
+            return []
+        if not S_ISDIR(stat.st_mode):
             return []
+        # adding or removing entries changes the directory's mtime
+        key = tuple(path)
+        cached = self._subtrees.get(key)
+        if cached is None or cached[0] != stat.st_mtime_ns:
+            nodes = self._loc_to_nodes(current_location)
+            cached = self._subtrees[key] = (stat.st_mtime_ns, nodes)
+        return cached[1]
 
     def get_partial_path(self, path=[]):
         current_location = self.root
-        found_path = []
-        rest_path = deque(path)
+        i = 0
         for item in path:
-            new_location = current_location / item
-            if new_location.is_dir():
-                current_location = new_location
-                rest_path.popleft()
-                found_path.append(item)
-            else:
+            current_location = current_location / item
+            if not current_location.is_dir():
                 break
-        return found_path, list(rest_path)
+            i += 1
+        return list(path[:i]), list(path[i:])
@@ -9,22 +9,19 @@ import argparse
 import re
 from datetime import datetime, timedelta, MINYEAR
 
-from collections import Counter, OrderedDict
+from itertools import compress
 
 import numpy as np
 
-from sklearn.feature_extraction.text import CountVectorizer
-from sklearn.feature_extraction.text import TfidfTransformer
-from sklearn.linear_model import SGDClassifier
-from sklearn.pipeline import Pipeline
-from sklearn.model_selection import StratifiedKFold
-from sklearn.metrics import confusion_matrix, classification_report
-
-import colored
-from colored import stylize
+# sklearn and colored are slow to import and only needed when a model is
+# trained or reported on, so they are imported in the functions using them
 
 DEFAULT_LEDGER_MAXIMUM_AGE = 180
 
+NGRAM_RANGE = (3, 9)
+
+N_FEATURES = 2**18
+
 
 def get_args():
     parser = argparse.ArgumentParser(
@@ -39,74 +36,114 @@ def get_args():
                         default=DEFAULT_LEDGER_MAXIMUM_AGE,
                         help="Maximum age, in days, of entries in ledger file "
                         "to use for training.")
+    parser.add_argument("-n", "--ngram-range", type=int, nargs=2,
+                        default=NGRAM_RANGE, metavar=("MIN", "MAX"),
+                        help="Lengths of character n-grams to use as "
+                        "features.")
     return parser.parse_args()
 
 
-def remove_small_groups(sources, targets, min_size=5):
-    """Returns sources and targets with small target groups removed."""
-    tcount = Counter(targets)
-    new_st = [(s, t) for s, t in zip(sources, targets)
-              if tcount[t] >= min_size]
-    if new_st:
-        return tuple(zip(*new_st))
-    else:
-        return ([], [])
+DIGITS_TO_ZERO = str.maketrans("123456789", "000000000")
 
 
 def clean_string(string):
-    string = re.sub(r"\d", "0", string)
-    return string.upper().strip()
+    return string.upper().translate(DIGITS_TO_ZERO).strip()
+
+
+def clean_strings(strings):
+    """Returns list of strings cleaned with clean_string."""
+    return [clean_string(string) for string in strings]
 
 
 def print_confusion_matrix(matrix, labels, fileout=sys.stdout):
     """Pretty print confusion matrix."""
+    import colored
+
     assert(matrix.shape[0] == len(labels))
+    # the escape codes are the same for every cell, so look them up once
+    isatty = fileout.isatty()
+    green, red, grey = (colored.fg(fg) for fg in ["green_1", "red_1", "grey_50"])
+    reset = colored.attr("reset")
     mm = np.max(matrix)
     ml = len(str(mm))
     ll = max(len(lab) for lab in labels)
-    fileout.write(" " * ll)
     tinylabs = (lab.split(":")[-1][0] for lab in labels)
-    for tinylab in tinylabs:
-        fileout.write(f"{tinylab:>{ml+1}s}")
-    fileout.write("\n")
+    header = [" " * ll]
+    header.extend(f"{tinylab:>{ml+1}s}" for tinylab in tinylabs)
+    header.append("\n")
+    fileout.write("".join(header))
     for j, (label, row) in enumerate(zip(labels, matrix)):
-        fileout.write(f"{label:>{ll}s}")
+        parts = [f"{label:>{ll}s}"]
         for i, v in enumerate(row):
             if i == j:
-                fg = "green_1"
+                fg = green
             elif v > 0:
-                fg = "red_1"
+                fg = red
             else:
-                fg = "grey_50"
-            if fileout.isatty():
-                fileout.write(stylize(f"{v:>{ml+1}d}", colored.fg(fg)))
+                fg = grey
+            if isatty:
+                parts.append(f"{fg}{v:>{ml+1}d}{reset}")
             else:
-                fileout.write(f"{v:>{ml+1}d}")
+                parts.append(f"{v:>{ml+1}d}")
+        parts.append("\n")
+        fileout.write("".join(parts))
+
+
+def make_features(n_features=N_FEATURES, ngram_range=NGRAM_RANGE):
+    """Returns the feature extraction part of the model. Features are
+character n-grams with lengths in ngram_range, hashed into n_features columns,
+collisions get more likely as it is made smaller. Nothing is learnt from the
+data, so strings can be transformed once and reused across fits."""
+    from sklearn.feature_extraction.text import HashingVectorizer
+    from sklearn.feature_extraction.text import TfidfTransformer
+    from sklearn.pipeline import Pipeline
+
+    return Pipeline([("vect", HashingVectorizer(analyzer="char",
+                                                ngram_range=ngram_range,
+                                                n_features=n_features,
+                                                alternate_sign=False,
+                                                norm=None)),
+                     ("tfidf", TfidfTransformer(use_idf=False))])
+
 
-        fileout.write("\n")
+def make_classifier():
+    """Returns the untrained classifier part of the model."""
+    from sklearn.linear_model import SGDClassifier
 
+    return SGDClassifier(loss="hinge", penalty="l2", alpha=0.001,
+                         random_state=42, max_iter=4, tol=None,
+                         n_jobs=-1)
 
-def make_model():
-    text_clf = Pipeline([("vect", CountVectorizer(analyzer="char",
-                                                  ngram_range=(3, 9))),
-                         ("tfidf", TfidfTransformer(use_idf=False)),
-                         ("clf", SGDClassifier(loss="hinge", penalty="l2",
-                                               alpha=0.001, random_state=42,
-                                               max_iter=4, tol=None))])
+
+def make_model(n_features=N_FEATURES, ngram_range=NGRAM_RANGE):
+    """Returns an untrained model, see make_features."""
+    from sklearn.pipeline import Pipeline
+
+    text_clf = Pipeline([("features", make_features(n_features, ngram_range)),
+                         ("clf", make_classifier())])
     return text_clf
 
 
 def read_csv_file(csv_file, delimiter=",", quotechar='"'):
     """Returns X, y and target_names for training CSV."""
     csv_reader = csv.reader(csv_file, delimiter=delimiter, quotechar=quotechar)
-    payees, accounts = zip(*csv_reader)
+    payees, accounts = [], []
+    for payee, account in csv_reader:
+        payees.append(payee)
+        accounts.append(account)
     X, y, target_names = payees_accounts_to_X_y(payees, accounts)
     return X, y, target_names
 
 
 LEDGER_PAYEE_LINE = r"^([0-9\-]+)(=[0-9\-]+)?(?:\s+([\*!]))?"\
-                                    "(?:\s+(\([^\)]*\)))?\s+(.*)$"
-LEDGER_ACCOUNT_LINE = r"\s+[\[\(]?(\S+)[\]\)]?(?:\s+(\S+))?"
+                                    r"(?:\s+(\([^\)]*\)))?\s+(.*)$"
+LEDGER_PAYEE_RE = re.compile(LEDGER_PAYEE_LINE)
+
+
+def parse_ledger_date(date_string):
+    """Makes a datetime from a ledger date, ignoring any auxiliary date."""
+    year, month, day = date_string.partition("=")[0].split("-")
+    return datetime(int(year), int(month), int(day))
 
 
 def parse_ledger_file(ledger_file, account_name, begin_date=None):
@@ -124,34 +161,45 @@ considered.
     skip_section = False
 
     current_date = None
+    dates = {}                  # many transactions share a date
     for i, line in enumerate(ledger_file, 1):
-        line = line[:-1]
-        if re.match(r"^~", line):
+        line = line.rstrip("\r\n")
+        first = line[:1]
+        if first == "~":
             skip_section = True
 
-        elif re.match(r"^\d", line):
+        elif first.isdigit():
             # date/payee line
             skip_section = False
-            match = re.match(LEDGER_PAYEE_LINE, line)
-            if match is None:
-                raise Exception(f"Bad payee line, line {i}.")
-            try:
-                current_date = datetime.strptime(match.group(1),
-                                                 "%Y-%m-%d")
-            except ValueError as e:
-                raise Exception(f"Bad date, line {i}.") from e
-            current_payee = match.group(5)
+            fields = line.split(None, 1)
+            if len(fields) == 2 and fields[1][0] not in "*!(":
+                date_string, current_payee = fields
+            else:
+                # state and code are rare, leave those to the regex
+                match = LEDGER_PAYEE_RE.match(line)
+                if match is None:
+                    raise Exception(f"Bad payee line, line {i}.")
+                date_string, current_payee = match.group(1), match.group(5)
+            current_date = dates.get(date_string)
+            if current_date is None:
+                try:
+                    current_date = parse_ledger_date(date_string)
+                except ValueError as e:
+                    raise Exception(f"Bad date, line {i}.") from e
+                dates[date_string] = current_date
             current_accounts = []
 
         elif skip_section:
             continue
 
-        elif re.match(r"^\s", line):
-            # account lines (only need to match the account name, no amounts)
-            match = re.match(LEDGER_ACCOUNT_LINE, line)
-            if match is None:
+        elif first.isspace():
+            # account lines (only need the account name, no amounts)
+            fields = line.split(None, 1)
+            if not fields:
                 raise Exception(f"Bad account line, line {i}.")
-            account = match.group(1)
+            account = fields[0]
+            if len(account) > 1 and account[0] in "[(":
+                account = account[1:]
             if account != account_name:
                 current_accounts.append(account)
 
@@ -164,21 +212,26 @@ considered.
     return all_accounts, payees, accounts
 
 
-def payees_accounts_to_X_y(payees, accounts):
+def payees_accounts_to_X_y(payees, accounts, min_size=5):
     """Converts lists of payees and names to X, y and target_names for use in
-models."""
-    payees, accounts = remove_small_groups(payees, accounts)
-    account_dict = OrderedDict((name, i) for i, name in enumerate(set(accounts)))
-
-    X = np.array([clean_string(s) for s in payees])
-    y = np.array([account_dict[account] for account in accounts])
-    target_names = list(account_dict.keys())
-    return X, y, target_names
+models. Accounts with fewer than min_size payees are left out."""
+    names, ids, counts = np.unique(np.array(accounts, dtype=str),
+                                   return_inverse=True, return_counts=True)
+    large = counts >= min_size
+    keep = large[ids]
+    # renumber the remaining accounts from zero
+    y = (np.cumsum(large) - 1)[ids[keep]]
+    X = np.array(clean_strings(compress(payees, keep)))
+    return X, y, names[large].tolist()
 
 
 def run(training_data,
          account_name,
-         ledger_maximum_age=DEFAULT_LEDGER_MAXIMUM_AGE):
+         ledger_maximum_age=DEFAULT_LEDGER_MAXIMUM_AGE,
+         ngram_range=NGRAM_RANGE):
+    from sklearn.model_selection import StratifiedKFold
+    from sklearn.metrics import confusion_matrix, classification_report
+
     begin_date = datetime.today() - timedelta(days=ledger_maximum_age)
     all_accounts, payees, accounts = parse_ledger_file(
         training_data, account_name, begin_date=begin_date)
@@ -186,13 +239,16 @@ def run(training_data,
     if len(X) < 1:
         sys.exit("Nothing to classify. Only small groups?")
 
-    text_clf = make_model()
+    # the features don't depend on the training split, so only extract once
+    features = make_features(ngram_range=tuple(ngram_range))
+    X_features = features.fit_transform(X)
+    clf = make_classifier()
 
     skf = StratifiedKFold(n_splits=3, shuffle=True, random_state=42)
     pred = np.empty_like(y)
     for train_index, test_index in skf.split(X, y):
-        text_clf.fit(X[train_index], y[train_index])
-        pred[test_index] = text_clf.predict(X[test_index])
+        clf.fit(X_features[train_index], y[train_index])
+        pred[test_index] = clf.predict(X_features[test_index])
 
     cm = confusion_matrix(y, pred)
     print_confusion_matrix(cm, target_names)
@@ -1,33 +1,104 @@
+from contextlib import contextmanager
+from functools import lru_cache
+
 from curtsies import Input, CursorAwareWindow, fmtstr
 from curtsies.fmtfuncs import yellow, bold
 
 from accounts.editor import Editor, Completion
 
+VISIBLE_COMPLETIONS = 20
+
+COMPLETIONS_START = fmtstr(" {")
+COMPLETIONS_SEPARATOR = fmtstr(" | ")
+COMPLETIONS_MORE = fmtstr("...")
+COMPLETIONS_END = fmtstr("}")
+
+# keys that can end the input, the keys after these belong to the next prompt
+FINISHING_KEYS = frozenset(["<Ctrl-d>", "<Ctrl-j>", "<Esc+j>"])
+
+
+def match_completions(typed, nodes):
+    """Makes Completions for the given Nodes that match typed, keeping their
+order."""
+    if not typed:
+        return [Completion(node, 2 if node.label else 3) for node in nodes]
+    typed = typed.lower()
+    completions = []
+    for node in nodes:
+        completion_type = fuzzy_sort_type(typed, node.label_lower)
+        if completion_type > 0:
+            completions.append(Completion(node, completion_type))
+    return completions
+
+
+def order_completions(completions):
+    """Orders Completions by type, best first. There are only three types, so
+this is done by grouping rather than sorting, which keeps the order within
+each type."""
+    if len(completions) < 2:
+        return completions
+    groups = {3: [], 2: [], 1: []}
+    for completion in completions:
+        groups[completion.type].append(completion)
+    return groups[3] + groups[2] + groups[1]
+
 
 def narrow_completions(typed, nodes):
-    """Makes Completions from given Nodes according to typed."""
-    completions = (Completion(node, fuzzy_sort_type(typed, node.label))
-                   for node in nodes)
+    """Makes Completions from given Nodes according to typed. The nodes should
+be sorted by label, as they are from Hierarchy.get_subtree."""
+    if not typed:
+        # everything matches and is already in order
+        return match_completions(typed, nodes)
+    return order_completions(match_completions(typed, nodes))
+
 
-    def sort_key(completion):
-        return (-completion.type, completion.node.label)
+class Narrower():
+    """Narrows completions, reusing the previous results where possible
 
-    return sorted((completion for completion in completions
-                   if completion.type > 0),
-                  key=sort_key)
+    Completions only ever match fewer nodes as the typed string grows, so when
+    it extends an earlier one only the earlier matches need to be checked.
+    The results for each shorter string are kept, so deleting characters goes
+    back to them without narrowing again.
+
+    """
+    def __init__(self):
+        self.nodes = None
+        # (typed, matches in label order, ordered completions), each extending
+        # the last
+        self.stack = []
+
+    def narrow(self, typed, nodes):
+        stack = self.stack
+        if nodes is not self.nodes:
+            self.nodes = nodes
+            stack.clear()
+        while stack and not typed.startswith(stack[-1][0]):
+            stack.pop()
+        if stack:
+            last_typed, last_matches, last_completions = stack[-1]
+            if typed == last_typed:
+                return last_completions
+            candidates = [completion.node for completion in last_matches]
+        else:
+            candidates = nodes
+        matches = match_completions(typed, candidates)
+        completions = matches if not typed else order_completions(matches)
+        stack.append((typed, matches, completions))
+        return completions
 
 
 def fuzzy_sort_type(typed, candidate):
-    """Returns the type of the match as a CompletionType."""
-    typed, candidate = typed.lower(), candidate.lower()
-    if typed == candidate:
-        return 3                # exact
-    elif candidate.startswith(typed):
-        return 2                # prefix
-    elif typed in candidate:
+    """Returns the type of the match as a CompletionType. Both strings should
+already be lowercase."""
+    index = candidate.find(typed)
+    if index < 0:
+        return 0                # no match
+    elif index > 0:
         return 1                # fuzzy
+    elif len(typed) == len(candidate):
+        return 3                # exact
     else:
-        return 0                # no match
+        return 2                # prefix
 
 
 def pathstring(path, separator):
@@ -42,126 +113,205 @@ def prompt_string(prompt, path, separator):
         return prompt
 
 
-def completion_string(completions, separator="", current=0):
-    completions = [fmtstr(t.node.label+separator) if t.node.internal
-                   else fmtstr(t.node.label)
-                   for t in completions]
-    if current < len(completions):
-        completions[current] = yellow(bold(completions[current]))
-    string = fmtstr(" | ").join(completions)
-    return fmtstr(" {") + string + fmtstr("}")
+@lru_cache(maxsize=1024)
+def label_fmtstr(label):
+    """Returns label as a fmtstr, cached as the same labels are shown on
+every keystroke."""
+    return fmtstr(label)
 
 
-def pydo_input(completion_tree, prompt="", initial_string="",
-               forbidden=[], history=[]):
-    separator = completion_tree.separator
+def completion_label(completion, separator=""):
+    node = completion.node
+    return node.label + separator if node.internal else node.label
+
+
+def completion_window(completions, separator="", current=0, width=None):
+    """Returns the start and end of the completions to show. These include
+current and as many around it as fit in two lines of the given width, up to
+VISIBLE_COMPLETIONS."""
+    if not completions:
+        return 0, 0
+    budget = 2 * width if width else float("inf")
+
+    def length(i):
+        return len(completion_label(completions[i], separator)) + 3
+
+    # fill in backwards from the current one first, then forwards
+    start, end = current, current + 1
+    used = length(current)
+    while (start > 0 and end - start < VISIBLE_COMPLETIONS
+           and used + length(start - 1) <= budget):
+        start -= 1
+        used += length(start)
+    while (end < len(completions) and end - start < VISIBLE_COMPLETIONS
+           and used + length(end) <= budget):
+        used += length(end)
+        end += 1
+    return start, end
+
+
+def completion_string(completions, separator="", current=0, width=None):
+    # only format as many as can be shown, keeping the current one in view
+    start, end = completion_window(completions, separator, current, width)
+    strings = [label_fmtstr(completion_label(t, separator))
+               for t in completions[start:end]]
+    if current - start < len(strings):
+        strings[current-start] = yellow(bold(strings[current-start]))
+    if start > 0:
+        strings.insert(0, COMPLETIONS_MORE)
+    if end < len(completions):
+        strings.append(COMPLETIONS_MORE)
+    string = COMPLETIONS_SEPARATOR.join(strings)
+    return COMPLETIONS_START + string + COMPLETIONS_END
+
+
+def keys_with_waiting(input_generator):
+    """Yields each key and whether more keys are already waiting, so that a
+burst of keys can be rendered once at the end."""
+    key = next(input_generator)
+    while True:
+        following = None
+        if key not in FINISHING_KEYS:
+            following = input_generator.send(0)
+        yield key, following is not None
+        if following is None:
+            following = next(input_generator)
+        key = following
+
+
+@contextmanager
+def pydo_session():
+    """Opens the terminal for a series of pydo_input calls."""
     with CursorAwareWindow(hide_cursor=False) as win, \
             Input(keynames="curtsies",
                   disable_terminal_start_stop=True) as input_generator:
-        initial_path = initial_string.split(separator)
-        current_path, rest = completion_tree.get_partial_path(initial_path)
-        initial_string = separator.join(rest)
-        editor = Editor(initial_string=initial_string,
-                        forbidden=forbidden,
-                        history=history)
-        nodes = completion_tree.get_subtree(current_path)
-        narrowed_completions = narrow_completions(initial_string, nodes)
-        completion_selected = 0
-        editor.render_to(win,
-                         prompt_string(prompt, current_path,
-                                       separator),
-                         completion_string(narrowed_completions,
-                                           separator,
-                                           completion_selected))
-        try:
-            for key in input_generator:
-                if key == "<Ctrl-d>":
-                    # EOF
-                    return None
-                elif key == "<Ctrl-j>" and narrowed_completions:
-                    # Completing Enter
-                    selected_node = narrowed_completions[completion_selected].node
-                    if selected_node.internal:
-                        current_path.append(selected_node.label)
-                        nodes = completion_tree.get_subtree(current_path)
-                        narrowed_completions = narrow_completions("", nodes)
-                        completion_selected = 0
-                        editor.empty()
-                    else:
-                        win.render_to_terminal([])
-                        pstr = pathstring(current_path, separator)
-                        if pstr:
-                            return f"{pstr}{separator}{selected_node.label}"
-                        else:
-                            return selected_node.label
-                elif key in ["<Esc+j>", "<Ctrl-j>"]:
-                    # Immediate Enter
+        yield win, input_generator
+
+
+def pydo_input(completion_tree, prompt="", initial_string="",
+               forbidden=[], history=[], session=None):
+    """Asks for a string, completing from completion_tree. Pass a session from
+pydo_session when asking for many strings in a row, otherwise the terminal is
+set up and restored just for this call."""
+    if session is None:
+        with pydo_session() as session:
+            return pydo_input(completion_tree, prompt, initial_string,
+                              forbidden, history, session)
+    win, input_generator = session
+    separator = completion_tree.separator
+    initial_path = initial_string.split(separator)
+    current_path, rest = completion_tree.get_partial_path(initial_path)
+    initial_string = separator.join(rest)
+    editor = Editor(initial_string=initial_string,
+                    forbidden=forbidden,
+                    history=history)
+    nodes = completion_tree.get_subtree(current_path)
+    narrower = Narrower()
+    narrowed_completions = narrower.narrow(initial_string, nodes)
+    completion_selected = 0
+    # only rebuilt when changed so the editor can reuse its rendering
+    tail_key = (narrowed_completions, completion_selected, win.width)
+    tail = completion_string(narrowed_completions, separator,
+                             completion_selected, win.width)
+    editor.render_to(win,
+                     prompt_string(prompt, current_path,
+                                   separator),
+                     tail)
+    try:
+        for key, waiting in keys_with_waiting(input_generator):
+            if key == "<Ctrl-d>":
+                # EOF
+                return None
+            elif key == "<Ctrl-j>" and narrowed_completions:
+                # Completing Enter
+                selected_node = narrowed_completions[completion_selected].node
+                if selected_node.internal:
+                    current_path.append(selected_node.label)
+                    nodes = completion_tree.get_subtree(current_path)
+                    narrowed_completions = narrower.narrow("", nodes)
+                    completion_selected = 0
+                    editor.empty()
+                else:
+                    win.render_to_terminal([])
                     pstr = pathstring(current_path, separator)
                     if pstr:
-                        return f"{pstr}{separator}{editor.to_string()}"
-                    else:
-                        return editor.to_string()
-                elif key == separator:
-                    # we might need to to go the next level
-                    if narrowed_completions and narrowed_completions[0].type == 3:
-                        # just remove other completions to pick it up later
-                        narrowed_completions = narrowed_completions[0:1]
-                    else:
-                        editor.edit_string(key, narrowed_completions)
-                        narrowed_completions = narrow_completions(
-                            editor.to_string(), nodes)
-                        completion_selected = 0
-                elif key in ["<Ctrl-h>", "<BACKSPACE>",
-                             "<Ctrl-BACKSPACE>", "<Esc+BACKSPACE>"]:
-                    if len(editor.to_string()) == 0 and current_path:
-                        current_path.pop()
-                        nodes = completion_tree.get_subtree(current_path)
-                        narrowed_completions = narrow_completions("", nodes)
-                        completion_selected = 0
+                        return f"{pstr}{separator}{selected_node.label}"
                     else:
-                        editor.edit_string(key, narrowed_completions)
-                        narrowed_completions = narrow_completions(
-                            editor.to_string(), nodes)
-                        completion_selected = 0
-                elif (key == "<Ctrl-n>"
-                      or (key == "<Ctrl-p>" and editor.has_more_history())):
+                        return selected_node.label
+            elif key in ["<Esc+j>", "<Ctrl-j>"]:
+                # Immediate Enter
+                pstr = pathstring(current_path, separator)
+                if pstr:
+                    return f"{pstr}{separator}{editor.to_string()}"
+                else:
+                    return editor.to_string()
+            elif key == separator:
+                # we might need to to go the next level
+                if narrowed_completions and narrowed_completions[0].type == 3:
+                    # just remove other completions to pick it up later
+                    narrowed_completions = narrowed_completions[0:1]
+                else:
                     editor.edit_string(key, narrowed_completions)
-                    recalled_path = editor.to_string().split(separator)
-                    current_path, rest_path = completion_tree.get_partial_path(
-                        recalled_path)
-                    rest = separator.join(rest_path)
-                    editor.set_string(rest)
-                    nodes = completion_tree.get_subtree(current_path)
-                    narrowed_completions = narrow_completions(
+                    narrowed_completions = narrower.narrow(
                         editor.to_string(), nodes)
                     completion_selected = 0
-                elif key == "<Ctrl-s>":
-                    completion_selected = ((completion_selected+1)
-                                           % len(narrowed_completions))
-                elif key == "<Ctrl-r>":
-                    completion_selected = ((completion_selected-1)
-                                           % len(narrowed_completions))
+            elif key in ["<Ctrl-h>", "<BACKSPACE>",
+                         "<Ctrl-BACKSPACE>", "<Esc+BACKSPACE>"]:
+                if len(editor.to_string()) == 0 and current_path:
+                    current_path.pop()
+                    nodes = completion_tree.get_subtree(current_path)
+                    narrowed_completions = narrower.narrow("", nodes)
+                    completion_selected = 0
                 else:
                     editor.edit_string(key, narrowed_completions)
-                    narrowed_completions = narrow_completions(editor.to_string(),
-                                                              nodes)
+                    narrowed_completions = narrower.narrow(
+                        editor.to_string(), nodes)
+                    completion_selected = 0
+            elif (key == "<Ctrl-n>"
+                  or (key == "<Ctrl-p>" and editor.has_more_history())):
+                editor.edit_string(key, narrowed_completions)
+                recalled_path = editor.to_string().split(separator)
+                current_path, rest_path = completion_tree.get_partial_path(
+                    recalled_path)
+                rest = separator.join(rest_path)
+                editor.set_string(rest)
+                nodes = completion_tree.get_subtree(current_path)
+                narrowed_completions = narrower.narrow(
+                    editor.to_string(), nodes)
+                completion_selected = 0
+            elif key == "<Ctrl-s>":
+                completion_selected = ((completion_selected+1)
+                                       % len(narrowed_completions))
+            elif key == "<Ctrl-r>":
+                completion_selected = ((completion_selected-1)
+                                       % len(narrowed_completions))
+            else:
+                editor.edit_string(key, narrowed_completions)
+                narrowed_completions = narrower.narrow(
+                    editor.to_string(), nodes)
+                completion_selected = 0
+            # we could have a single completed string here, if it's an
+            # internal node then go to the next level
+            if len(narrowed_completions) == 1:
+                completion = narrowed_completions[0]
+                if completion.node.label == editor.to_string() \
+                   and completion.node.internal:
+                    current_path.append(completion.node.label)
+                    nodes = completion_tree.get_subtree(current_path)
+                    narrowed_completions = narrower.narrow("", nodes)
                     completion_selected = 0
-                # we could have a single completed string here, if it's an
-                # internal node then go to the next level
-                if len(narrowed_completions) == 1:
-                    completion = narrowed_completions[0]
-                    if completion.node.label == editor.to_string() \
-                       and completion.node.internal:
-                        current_path.append(completion.node.label)
-                        nodes = completion_tree.get_subtree(current_path)
-                        narrowed_completions = narrow_completions("", nodes)
-                        completion_selected = 0
-                        editor.empty()
-                editor.render_to(win,
-                                 prompt_string(prompt, current_path,
-                                               separator),
-                                 completion_string(narrowed_completions,
-                                                   separator,
-                                                   completion_selected))
-        except KeyboardInterrupt:
-            return None
+                    editor.empty()
+            if waiting:
+                continue
+            if (narrowed_completions, completion_selected,
+                    win.width) != tail_key:
+                tail_key = (narrowed_completions, completion_selected,
+                            win.width)
+                tail = completion_string(narrowed_completions, separator,
+                                         completion_selected, win.width)
+            editor.render_to(win,
+                             prompt_string(prompt, current_path,
+                                           separator),
+                             tail)
+    except KeyboardInterrupt:
+        return None
@@ -9,9 +9,7 @@ import sys
 if __name__ == "__main__":
     reader = csv.DictReader(sys.stdin)
     writer = csv.writer(sys.stdout)
-    for row in reader:
-        date = row["Date"]
-        name = row["Name"] or row["Description"]
-        amount = row["Money Out"] or row["Money In"]
-
-        writer.writerow([date, name, amount])
+    writer.writerows([row["Date"],
+                      row["Name"] or row["Description"],
+                      row["Money Out"] or row["Money In"]]
+                     for row in reader)